@@ -0,0 +1,374 @@
+import argparse
+import contextlib
+import fcntl
+import json
+import os
+import time
+
+import pandas as pd
+
+
+KEY_COLUMNS = ['Report Date', 'Persona', 'Aggregation Type', 'Attribute Name']
+VALUE_COLUMNS = [
+    'Persona Attribute Proportion',
+    'Base Adjusted Population Attribute Proportion',
+    'Index'
+]
+HISTORY_COLUMNS = KEY_COLUMNS + VALUE_COLUMNS
+
+# Blocks are sorted attribute-first so each aggregation type and attribute is
+# a contiguous run of rows that the index can point at directly
+BLOCK_SORT_COLUMNS = ['Aggregation Type', 'Attribute Name', 'Persona', 'Report Date']
+
+INDEX_FILE = 'index.json'
+LOCK_FILE = 'index.lock'
+LOCK_TIMEOUT = 30.0
+
+
+def default_history_dir():
+    script_dir = os.path.dirname(__file__)
+    return os.path.join(script_dir, '..', '..', 'index_history')
+
+
+@contextlib.contextmanager
+def _locked(history_dir, shared=False):
+    """
+    Holds an flock on the store's lock file for the duration of the block.
+    Writers take an exclusive lock and readers a shared one. The OS releases
+    the lock if the holding process dies, so a killed run never wedges the
+    store.
+
+    Raises:
+        TimeoutError: If the lock cannot be acquired within LOCK_TIMEOUT seconds
+    """
+    if not shared:
+        os.makedirs(history_dir, exist_ok=True)
+    lock_path = os.path.join(history_dir, LOCK_FILE)
+    operation = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+    deadline = time.monotonic() + LOCK_TIMEOUT
+    fd = os.open(lock_path, os.O_CREAT | os.O_WRONLY)
+    try:
+        while True:
+            try:
+                fcntl.flock(fd, operation | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                if time.monotonic() > deadline:
+                    raise TimeoutError(
+                        f"Could not lock history store '{history_dir}' "
+                        f"within {LOCK_TIMEOUT} seconds"
+                    )
+                time.sleep(0.05)
+        yield
+    finally:
+        # Closing the descriptor releases the lock
+        os.close(fd)
+
+
+def _load_index(history_dir):
+    index_path = os.path.join(history_dir, INDEX_FILE)
+    if not os.path.exists(index_path):
+        return {'next_block': 0, 'blocks': []}
+    with open(index_path) as f:
+        return json.load(f)
+
+
+def _save_index(history_dir, index):
+    # Write to a temp file and swap it in so readers never see a partial index
+    index_path = os.path.join(history_dir, INDEX_FILE)
+    tmp_path = index_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(index, f, indent=2)
+    os.replace(tmp_path, index_path)
+
+
+def _row_range(block, aggregation_type=None, attribute_name=None):
+    """
+    Returns the [start, stop) data rows of a block that can match the filters,
+    or None if the block holds no matching rows.
+    """
+    if aggregation_type is None:
+        if attribute_name is None:
+            return [0, block['rows']]
+        ranges = [
+            attributes[attribute_name]
+            for attributes in block['row_ranges'].values()
+            if attribute_name in attributes
+        ]
+    else:
+        attributes = block['row_ranges'].get(aggregation_type, {})
+        if attribute_name is None:
+            ranges = list(attributes.values())
+        else:
+            ranges = [attributes[attribute_name]] if attribute_name in attributes else []
+
+    if not ranges:
+        return None
+    return [min(r[0] for r in ranges), max(r[1] for r in ranges)]
+
+
+def _read_block(history_dir, block, row_range=None):
+    if row_range is None:
+        row_range = [0, block['rows']]
+    start, stop = row_range
+    # Keep the header line and skip straight to the requested rows. Key
+    # values such as "NA" or "None" must come back as strings, not NaN
+    return pd.read_csv(
+        os.path.join(history_dir, block['file']),
+        skiprows=range(1, start + 1),
+        nrows=stop - start,
+        dtype={col: str for col in KEY_COLUMNS},
+        keep_default_na=False
+    )
+
+
+def _write_block(history_dir, index, partition, df):
+    """
+    Writes df as a new block file in a partition and returns its index entry.
+    The caller is responsible for holding the lock and saving the index.
+    """
+    df = df.sort_values(BLOCK_SORT_COLUMNS, kind='stable').reset_index(drop=True)
+
+    block_file = os.path.join(partition, f"block-{index['next_block']:06d}.csv")
+    index['next_block'] += 1
+    os.makedirs(os.path.join(history_dir, partition), exist_ok=True)
+    df[HISTORY_COLUMNS].to_csv(os.path.join(history_dir, block_file), index=False)
+
+    # Row ranges of each (aggregation type, attribute) run in the sorted block
+    row_ranges = {}
+    for (aggregation_type, attribute_name), rows in df.groupby(
+        ['Aggregation Type', 'Attribute Name'], sort=False
+    ).indices.items():
+        row_ranges.setdefault(aggregation_type, {})[attribute_name] = [int(rows[0]), int(rows[-1]) + 1]
+
+    return {
+        'file': block_file,
+        'partition': partition,
+        'rows': len(df),
+        'min_date': df['Report Date'].min(),
+        'max_date': df['Report Date'].max(),
+        'personas': sorted(df['Persona'].unique().tolist()),
+        'row_ranges': row_ranges,
+    }
+
+
+def _latest_per_key(df):
+    # Later rows come from later appends, so they win for a repeated key
+    return df.drop_duplicates(KEY_COLUMNS, keep='last')
+
+
+def append_run(merged_df, report_date, persona, history_dir=None):
+    """
+    Appends the output of merge_all_index_aggregations() to the history store.
+
+    Each call writes one new block under the report month's partition, e.g.
+    "2024-06/block-000012.csv", and records it in index.json. Existing blocks
+    are never modified. Re-running a report date and persona appends new rows
+    that supersede the earlier ones in queries and compaction.
+
+    Args:
+        merged_df: The dataframe from merge_all_index_aggregations()
+        report_date: Date the report describes (date, datetime or ISO string)
+        persona: Name of the persona the report was run for
+        history_dir: Root of the history store, defaults to index_history/
+
+    Returns:
+        The index entry of the block written
+
+    Raises:
+        ValueError: If merged_df has no rows
+    """
+    if merged_df.empty:
+        raise ValueError("Cannot append an empty run to the history store")
+
+    if history_dir is None:
+        history_dir = default_history_dir()
+
+    report_date = pd.Timestamp(report_date).strftime('%Y-%m-%d')
+
+    run_df = merged_df.copy()
+    run_df['Report Date'] = report_date
+    run_df['Persona'] = str(persona)
+    run_df['Attribute Name'] = run_df['Attribute Name'].astype(str)
+    run_df = _latest_per_key(run_df)
+
+    with _locked(history_dir):
+        index = _load_index(history_dir)
+        block = _write_block(history_dir, index, report_date[:7], run_df)
+        index['blocks'].append(block)
+        _save_index(history_dir, index)
+
+    return block
+
+
+def query_history(
+    history_dir=None,
+    start_date=None,
+    end_date=None,
+    persona=None,
+    aggregation_type=None,
+    attribute_name=None
+):
+    """
+    Returns the history rows matching all of the given filters.
+
+    index.json is used to skip blocks outside the date range or without the
+    persona, and to read only the rows of the requested aggregation type and
+    attribute from the remaining blocks. When a key was appended more than
+    once, only the most recent row is returned.
+
+    Args:
+        history_dir: Root of the history store, defaults to index_history/
+        start_date: Inclusive lower bound on Report Date
+        end_date: Inclusive upper bound on Report Date
+        persona: Only return rows for this persona
+        aggregation_type: Only return rows for this aggregation type, e.g. 'Age'
+        attribute_name: Only return rows for this attribute, e.g. '18-24'
+
+    Returns:
+        A dataframe with HISTORY_COLUMNS, sorted by Report Date
+    """
+    if history_dir is None:
+        history_dir = default_history_dir()
+
+    if start_date is not None:
+        start_date = pd.Timestamp(start_date).strftime('%Y-%m-%d')
+    if end_date is not None:
+        end_date = pd.Timestamp(end_date).strftime('%Y-%m-%d')
+    if persona is not None:
+        persona = str(persona)
+    if attribute_name is not None:
+        attribute_name = str(attribute_name)
+
+    # Nothing has been appended yet; don't create the store just to read it
+    if not os.path.exists(os.path.join(history_dir, INDEX_FILE)):
+        return pd.DataFrame(columns=HISTORY_COLUMNS)
+
+    frames = []
+    with _locked(history_dir, shared=True):
+        # Blocks are listed in append order, which _latest_per_key relies on
+        for block in _load_index(history_dir)['blocks']:
+            # ISO dates compare correctly as strings
+            if start_date is not None and block['max_date'] < start_date:
+                continue
+            if end_date is not None and block['min_date'] > end_date:
+                continue
+            if persona is not None and persona not in block['personas']:
+                continue
+            row_range = _row_range(block, aggregation_type, attribute_name)
+            if row_range is None:
+                continue
+            frames.append(_read_block(history_dir, block, row_range))
+
+    if not frames:
+        return pd.DataFrame(columns=HISTORY_COLUMNS)
+
+    result = pd.concat(frames, ignore_index=True)
+
+    mask = pd.Series(True, index=result.index)
+    if start_date is not None:
+        mask &= result['Report Date'] >= start_date
+    if end_date is not None:
+        mask &= result['Report Date'] <= end_date
+    if persona is not None:
+        mask &= result['Persona'] == persona
+    if aggregation_type is not None:
+        mask &= result['Aggregation Type'] == aggregation_type
+    if attribute_name is not None:
+        mask &= result['Attribute Name'] == attribute_name
+
+    result = _latest_per_key(result.loc[mask])
+    result = result.sort_values(KEY_COLUMNS, kind='stable').reset_index(drop=True)
+
+    return result
+
+
+def compact(history_dir=None):
+    """
+    Merges the blocks of each partition into a single sorted block.
+
+    Where a key was appended more than once, only the most recent row is
+    kept. The new blocks are written and the index is swapped in before the
+    old block files are removed, so an interrupted compaction leaves the
+    store readable.
+
+    Args:
+        history_dir: Root of the history store, defaults to index_history/
+
+    Returns:
+        The number of block files removed
+    """
+    if history_dir is None:
+        history_dir = default_history_dir()
+
+    with _locked(history_dir):
+        index = _load_index(history_dir)
+
+        # A key's report date fixes its partition, so duplicates never span partitions
+        partitions = {}
+        for block in index['blocks']:
+            partitions.setdefault(block['partition'], []).append(block)
+
+        new_blocks = []
+        stale_blocks = []
+        for partition in sorted(partitions):
+            blocks = partitions[partition]
+            if len(blocks) == 1:
+                new_blocks.append(blocks[0])
+                continue
+            merged_df = pd.concat([_read_block(history_dir, block) for block in blocks], ignore_index=True)
+            new_blocks.append(_write_block(history_dir, index, partition, _latest_per_key(merged_df)))
+            stale_blocks.extend(blocks)
+
+        index['blocks'] = new_blocks
+        _save_index(history_dir, index)
+
+        for block in stale_blocks:
+            os.remove(os.path.join(history_dir, block['file']))
+
+    return len(stale_blocks)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Append-only history of merged index aggregations")
+    parser.add_argument('--history-dir', default=None)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    append_parser = subparsers.add_parser('append', help="Append a merged_index_aggregations.csv run")
+    append_parser.add_argument('csv_path')
+    append_parser.add_argument('--report-date', required=True)
+    append_parser.add_argument('--persona', required=True)
+
+    query_parser = subparsers.add_parser('query', help="Print matching history rows")
+    query_parser.add_argument('--start-date')
+    query_parser.add_argument('--end-date')
+    query_parser.add_argument('--persona')
+    query_parser.add_argument('--aggregation-type')
+    query_parser.add_argument('--attribute-name')
+
+    subparsers.add_parser('compact', help="Merge small blocks within each partition")
+
+    args = parser.parse_args()
+
+    if args.command == 'append':
+        merged_df = pd.read_csv(args.csv_path, dtype={'Attribute Name': str}, keep_default_na=False)
+        block = append_run(merged_df, args.report_date, args.persona, args.history_dir)
+        print(f"Appended {block['rows']} rows to {block['file']}")
+    elif args.command == 'query':
+        pd.set_option('display.max_rows', None)
+        pd.set_option('display.width', None)
+        print(query_history(
+            args.history_dir,
+            start_date=args.start_date,
+            end_date=args.end_date,
+            persona=args.persona,
+            aggregation_type=args.aggregation_type,
+            attribute_name=args.attribute_name
+        ).to_string(index=False))
+    elif args.command == 'compact':
+        removed = compact(args.history_dir)
+        print(f"Compacted {removed} blocks")
+
+
+if __name__ == "__main__":
+    main()
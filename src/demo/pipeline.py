@@ -0,0 +1,249 @@
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import glob
+import gzip
+import io
+import os
+import re
+import time
+
+from history import append_run
+from preprocess import load_pandas_and_format
+from synthesis import merge_all_index_aggregations
+
+
+WORKBOOK_PATTERNS = ('*.xlsx', '*.xlsx.gz')
+
+
+def find_workbooks(input_dir):
+    """
+    Lists the index report workbooks in a directory, sorted by file name.
+
+    Args:
+        input_dir: Directory containing .xlsx or gzip-compressed .xlsx.gz workbooks
+
+    Returns:
+        A sorted list of workbook paths
+    """
+    paths = []
+    for pattern in WORKBOOK_PATTERNS:
+        paths.extend(glob.glob(os.path.join(input_dir, pattern)))
+    return sorted(paths)
+
+
+def read_workbook(path, read_delay=0.0):
+    """
+    Reads a workbook from disk, decompresses it if needed and parses the
+    "Index Report" sheet.
+
+    Args:
+        path: Path to a .xlsx or .xlsx.gz workbook
+        read_delay: Seconds to sleep before reading, used to simulate a slow
+            network filesystem against a local directory
+
+    Returns:
+        The raw dataframe, as returned by load_pandas_and_format()
+    """
+    if read_delay:
+        time.sleep(read_delay)
+
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    if path.endswith('.gz'):
+        data = gzip.decompress(data)
+
+    return load_pandas_and_format(io.BytesIO(data))
+
+
+def _workbook_stem(path):
+    # "reports/2024-06.xlsx.gz" -> "2024-06"
+    name = os.path.basename(path)
+    for suffix in ('.gz', '.xlsx'):
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+    return name
+
+
+def output_path_for(path, output_dir):
+    """
+    Builds the merged CSV path for a workbook, e.g.
+    "2024-06.xlsx.gz" -> "<output_dir>/2024-06_merged_index_aggregations.csv".
+    """
+    return os.path.join(output_dir, f'{_workbook_stem(path)}_merged_index_aggregations.csv')
+
+
+def history_key_for(path, persona=None):
+    """
+    Parses the (report date, persona) history key from a workbook name of the
+    form YYYY-MM-DD_<persona>, e.g.
+    "2024-06-01_persona_a.xlsx.gz" -> ("2024-06-01", "persona_a").
+
+    Args:
+        path: Workbook path
+        persona: If given, used instead of the persona in the file name, which
+            may then be omitted ("2024-06-01.xlsx")
+
+    Raises:
+        ValueError: If the file name does not start with a date, or has no
+            persona and none was given
+    """
+    match = re.match(r'(\d{4}-\d{2}-\d{2})(?:_(.+))?$', _workbook_stem(path))
+    if match is None:
+        raise ValueError(
+            f"Cannot determine the report date of '{path}'. "
+            "Workbook names must start with YYYY-MM-DD to be added to the history store."
+        )
+    if persona is None:
+        persona = match.group(2)
+        if persona is None:
+            raise ValueError(
+                f"Cannot determine the persona of '{path}'. "
+                "Name the workbook YYYY-MM-DD_<persona> or pass a persona."
+            )
+    return match.group(1), str(persona)
+
+
+async def prefetch_workbooks(paths, prefetch_depth=2, read_delay=0.0):
+    """
+    Yields (path, raw dataframe) pairs in order while reading ahead.
+
+    Up to prefetch_depth workbooks are read and decompressed concurrently in
+    worker threads. A new read only starts once the consumer takes the oldest
+    result, so at most prefetch_depth workbooks are being read or waiting to
+    be consumed, plus the one the consumer currently holds.
+
+    Args:
+        paths: Workbook paths, in the order they should be processed
+        prefetch_depth: Maximum number of workbooks read ahead of the consumer
+        read_delay: Passed through to read_workbook()
+
+    Yields:
+        (path, df) tuples in the same order as paths
+
+    Raises:
+        ValueError: If prefetch_depth is less than 1
+    """
+    if prefetch_depth < 1:
+        raise ValueError(f"prefetch_depth must be at least 1, got {prefetch_depth}")
+
+    loop = asyncio.get_running_loop()
+    # A dedicated pool so prefetch_depth reads can run even when the default
+    # executor has fewer workers
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=prefetch_depth)
+    pending_paths = collections.deque(paths)
+    in_flight = collections.deque()
+
+    def start_reads():
+        while pending_paths and len(in_flight) < prefetch_depth:
+            path = pending_paths.popleft()
+            future = loop.run_in_executor(executor, read_workbook, path, read_delay)
+            in_flight.append((path, future))
+
+    try:
+        start_reads()
+        while in_flight:
+            path, future = in_flight.popleft()
+            df = await future
+            start_reads()
+            yield path, df
+    finally:
+        # Stop waiting on outstanding reads if the consumer stops early or a
+        # read fails; threads already running finish in the background
+        for _, future in in_flight:
+            future.cancel()
+        await asyncio.gather(*(future for _, future in in_flight), return_exceptions=True)
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+async def process_reports(
+    paths,
+    output_dir,
+    prefetch_depth=2,
+    read_delay=0.0,
+    history_dir=None,
+    persona=None
+):
+    """
+    Aggregates each workbook and writes its merged CSV, prefetching the next
+    workbooks while the current one is aggregated and written.
+
+    Args:
+        paths: Workbook paths to process
+        output_dir: Directory the merged CSVs are written to
+        prefetch_depth: Maximum number of workbooks read ahead of aggregation
+        read_delay: Passed through to read_workbook()
+        history_dir: If given, each run is also appended to this history
+            store, keyed by history_key_for()
+        persona: Persona recorded for every workbook in the history store,
+            overriding the persona in the workbook names
+
+    Returns:
+        A list of the CSV paths written, in the same order as paths
+
+    Raises:
+        ValueError: If history_dir is given and a workbook has no history key,
+            or two workbooks share one
+    """
+    if history_dir is not None:
+        # Fail before reading anything rather than let one workbook
+        # silently supersede another in the history store
+        history_keys = {}
+        paths_by_key = {}
+        for path in paths:
+            key = history_key_for(path, persona)
+            if key in paths_by_key:
+                raise ValueError(
+                    f"'{paths_by_key[key]}' and '{path}' share the report date and "
+                    f"persona {key}, so one would replace the other in the history store"
+                )
+            history_keys[path] = key
+            paths_by_key[key] = path
+
+    os.makedirs(output_dir, exist_ok=True)
+
+    written = []
+    async for path, df in prefetch_workbooks(paths, prefetch_depth, read_delay):
+        merged_df = await asyncio.to_thread(merge_all_index_aggregations, df)
+        csv_path = output_path_for(path, output_dir)
+        await asyncio.to_thread(merged_df.to_csv, csv_path, index=False)
+        if history_dir is not None:
+            report_date, workbook_persona = history_keys[path]
+            await asyncio.to_thread(append_run, merged_df, report_date, workbook_persona, history_dir)
+        written.append(csv_path)
+    return written
+
+
+def main():
+    script_dir = os.path.dirname(__file__)
+    parser = argparse.ArgumentParser(description="Aggregate every index report workbook in a directory")
+    parser.add_argument('--input-dir', default=os.path.join(script_dir, '..', '..', 'raw_input_files'))
+    parser.add_argument('--output-dir', default=os.path.join(script_dir, '..', '..', 'merged_outputs'))
+    parser.add_argument('--prefetch-depth', type=int, default=2,
+                        help="Maximum number of workbooks read ahead of aggregation")
+    parser.add_argument('--read-delay', type=float, default=0.0,
+                        help="Seconds added to each read to simulate a slow filesystem")
+    parser.add_argument('--history-dir', default=None,
+                        help="Also append each run to this history store")
+    parser.add_argument('--persona', default=None,
+                        help="Persona recorded for every workbook in the history store "
+                             "(default: taken from YYYY-MM-DD_<persona> workbook names)")
+    args = parser.parse_args()
+
+    paths = find_workbooks(args.input_dir)
+    written = asyncio.run(process_reports(
+        paths,
+        args.output_dir,
+        prefetch_depth=args.prefetch_depth,
+        read_delay=args.read_delay,
+        history_dir=args.history_dir,
+        persona=args.persona
+    ))
+    for csv_path in written:
+        print(csv_path)
+
+
+if __name__ == "__main__":
+    main()
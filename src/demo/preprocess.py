@@ -2,10 +2,12 @@ import pandas as pd
 import os
 
 
-def load_pandas_and_format():
-    # Get path relative to this script's location
-    script_dir = os.path.dirname(__file__)
-    file_path = os.path.join(script_dir, '..', '..', 'raw_input_files', 'raw_index_report.xlsx')
+def load_pandas_and_format(file_path=None):
+    # Default to the report path relative to this script's location;
+    # file_path may also be a file-like object holding workbook bytes
+    if file_path is None:
+        script_dir = os.path.dirname(__file__)
+        file_path = os.path.join(script_dir, '..', '..', 'raw_input_files', 'raw_index_report.xlsx')
     raw_pandas_df = pd.read_excel(file_path, sheet_name="Index Report", header=1)
     return raw_pandas_df
 
@@ -1,4 +1,7 @@
+import argparse
+
 import pandas as pd
+from history import append_run
 from preprocess import (
     load_pandas_and_format,
     index_aggregation_by_age,
@@ -78,6 +81,20 @@ def merge_all_index_aggregations(df):
 
 
 def main():
+    parser = argparse.ArgumentParser(description="Merge all index aggregations for the raw index report")
+    parser.add_argument('--history-dir', default=None,
+                        help="Also append this run to the history store in this directory")
+    parser.add_argument('--report-date', default=None,
+                        help="Date the report describes, recorded in the history store")
+    parser.add_argument('--persona', default=None,
+                        help="Persona recorded in the history store")
+    args = parser.parse_args()
+    if args.history_dir is not None:
+        if args.report_date is None:
+            parser.error("--report-date is required with --history-dir")
+        if args.persona is None:
+            parser.error("--persona is required with --history-dir")
+
     df = load_pandas_and_format()
     merged_df = merge_all_index_aggregations(df)
     print(merged_df)
@@ -85,6 +102,10 @@ def main():
     # Optionally save to CSV
     merged_df.to_csv('merged_index_aggregations.csv', index=False)
 
+    if args.history_dir is not None:
+        block = append_run(merged_df, args.report_date, args.persona, args.history_dir)
+        print(f"Appended {block['rows']} rows to {block['file']}")
+
 
 if __name__ == "__main__":
     main()
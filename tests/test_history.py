@@ -0,0 +1,116 @@
+import json
+import os
+
+import pandas as pd
+import pytest
+
+import history
+from history import append_run, compact, query_history
+
+
+def make_run(age_18_24_index):
+    return pd.DataFrame({
+        'Aggregation Type': ['Age', 'Age', 'Gender', 'Gender'],
+        'Attribute Name': ['18-24', '25-34', 'Gender - Male', 'Gender - Female'],
+        'Persona Attribute Proportion': [50, 50, 40, 60],
+        'Base Adjusted Population Attribute Proportion': [10, 20, 50, 50],
+        'Index': [age_18_24_index, 250, 80, 120],
+    })
+
+
+def test_append_rejects_empty_run(tmp_path):
+    with pytest.raises(ValueError, match='empty'):
+        append_run(make_run(500).iloc[0:0], '2024-01-15', 'A', str(tmp_path))
+
+    assert query_history(str(tmp_path), start_date='2024-01-01').empty
+
+
+def test_trend_query_reads_only_matching_rows(tmp_path, monkeypatch):
+    for month, index_value in [(1, 500), (2, 510), (3, 520)]:
+        append_run(make_run(index_value), f'2024-0{month}-15', 'A', str(tmp_path))
+    append_run(make_run(900), '2024-02-15', 'B', str(tmp_path))
+
+    rows_read = []
+    read_block = history._read_block
+
+    def counting_read_block(*args):
+        df = read_block(*args)
+        rows_read.append(len(df))
+        return df
+
+    monkeypatch.setattr(history, '_read_block', counting_read_block)
+
+    trend = query_history(
+        str(tmp_path),
+        start_date='2024-02-01',
+        end_date='2024-03-31',
+        persona='A',
+        aggregation_type='Age',
+        attribute_name='18-24'
+    )
+
+    assert trend['Report Date'].tolist() == ['2024-02-15', '2024-03-15']
+    assert trend['Index'].tolist() == [510, 520]
+    # Two blocks in range for persona A, one row read from each
+    assert rows_read == [1, 1]
+
+
+def test_rerun_supersedes_earlier_rows_and_compaction_keeps_latest(tmp_path):
+    append_run(make_run(500), '2024-01-15', 'A', str(tmp_path))
+    append_run(make_run(600), '2024-01-15', 'A', str(tmp_path))
+    append_run(make_run(700), '2024-01-20', 'A', str(tmp_path))
+
+    def age_18_24():
+        return query_history(str(tmp_path), aggregation_type='Age', attribute_name='18-24')
+
+    assert age_18_24()['Index'].tolist() == [600, 700]
+
+    assert compact(str(tmp_path)) == 3
+    with open(os.path.join(tmp_path, 'index.json')) as f:
+        blocks = json.load(f)['blocks']
+    assert len(blocks) == 1
+    assert blocks[0]['rows'] == 8
+    assert age_18_24()['Index'].tolist() == [600, 700]
+    assert len(query_history(str(tmp_path))) == 8
+
+
+def test_lock_blocks_concurrent_writers(tmp_path, monkeypatch):
+    monkeypatch.setattr(history, 'LOCK_TIMEOUT', 0.1)
+    with history._locked(str(tmp_path)):
+        with pytest.raises(TimeoutError):
+            append_run(make_run(500), '2024-01-15', 'A', str(tmp_path))
+
+
+def test_null_like_keys_round_trip(tmp_path):
+    run = make_run(500)
+    run.loc[1, 'Attribute Name'] = 'None'
+    append_run(run, '2024-01-15', 'NA', str(tmp_path))
+    append_run(make_run(600), '2024-01-20', 'NA', str(tmp_path))
+
+    assert len(query_history(str(tmp_path), persona='NA')) == 8
+    assert compact(str(tmp_path)) == 2
+
+    none_rows = query_history(str(tmp_path), persona='NA', aggregation_type='Age', attribute_name='None')
+    assert none_rows['Report Date'].tolist() == ['2024-01-15']
+    assert none_rows['Index'].tolist() == [250]
+
+
+def test_query_converts_persona_to_string(tmp_path):
+    append_run(make_run(500), '2024-01-15', 7, str(tmp_path))
+
+    assert len(query_history(str(tmp_path), persona=7)) == 4
+
+
+def test_query_missing_store_returns_empty_without_creating_it(tmp_path):
+    history_dir = tmp_path / 'history'
+
+    assert query_history(str(history_dir)).empty
+    assert not history_dir.exists()
+
+
+def test_leftover_lock_file_does_not_block(tmp_path):
+    # A killed writer leaves the lock file behind but the OS drops its flock
+    (tmp_path / history.LOCK_FILE).touch()
+
+    append_run(make_run(500), '2024-01-15', 'A', str(tmp_path))
+    assert len(query_history(str(tmp_path))) == 4
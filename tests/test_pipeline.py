@@ -0,0 +1,159 @@
+import asyncio
+import gzip
+import os
+import threading
+import time
+
+import pandas as pd
+import pytest
+
+import pipeline
+from history import query_history
+from pipeline import find_workbooks, prefetch_workbooks, process_reports
+
+
+def write_workbook(path, persona_proportion):
+    raw_df = pd.DataFrame({
+        'Attribute Name': ['Individuals of Age - 20', 'Individuals of Age - 30'],
+        'Persona Attribute Proportion': [persona_proportion, 1 - persona_proportion],
+        'Base Adjusted Population Attribute Proportion': [0.5, 0.5],
+    })
+    # The loader reads the "Index Report" sheet with its header on the second row
+    with pd.ExcelWriter(path) as writer:
+        raw_df.to_excel(writer, sheet_name='Index Report', startrow=1, index=False)
+
+
+@pytest.fixture
+def report_dir(tmp_path):
+    input_dir = tmp_path / 'reports'
+    input_dir.mkdir()
+    for i, proportion in enumerate([0.1, 0.2, 0.3, 0.4]):
+        path = input_dir / f'2024-0{i + 1}-01.xlsx'
+        write_workbook(path, proportion)
+        if i % 2:
+            with open(path, 'rb') as f:
+                data = f.read()
+            with open(str(path) + '.gz', 'wb') as f:
+                f.write(gzip.compress(data))
+            os.remove(path)
+    return input_dir
+
+
+async def collect(paths, **kwargs):
+    return [item async for item in prefetch_workbooks(paths, **kwargs)]
+
+
+def test_process_reports_writes_outputs_in_path_order(report_dir, tmp_path):
+    paths = find_workbooks(str(report_dir))
+    written = asyncio.run(process_reports(paths, str(tmp_path / 'out'), prefetch_depth=3, read_delay=0.01))
+
+    assert [os.path.basename(p) for p in written] == [
+        f'2024-0{i}-01_merged_index_aggregations.csv' for i in range(1, 5)
+    ]
+    persona_18_24 = [pd.read_csv(p)['Persona Attribute Proportion'][0] for p in written]
+    assert persona_18_24 == [10, 20, 30, 40]
+
+
+class RecordingReader:
+    """Stands in for read_workbook, recording when reads start and overlap."""
+
+    def __init__(self, duration):
+        self.duration = duration
+        self.lock = threading.Lock()
+        self.started = []
+        self.active = 0
+        self.peak_active = 0
+        self.consumed = 0
+        self.started_vs_consumed = []
+
+    def __call__(self, path, read_delay=0.0):
+        with self.lock:
+            self.started.append(path)
+            self.started_vs_consumed.append((len(self.started), self.consumed))
+            self.active += 1
+            self.peak_active = max(self.peak_active, self.active)
+        time.sleep(self.duration)
+        with self.lock:
+            self.active -= 1
+        return path
+
+
+def test_prefetch_reads_concurrently(monkeypatch):
+    reader = RecordingReader(duration=0.2)
+    monkeypatch.setattr(pipeline, 'read_workbook', reader)
+    paths = [f'report-{i}.xlsx' for i in range(8)]
+
+    results = asyncio.run(collect(paths, prefetch_depth=4))
+
+    assert [path for path, _ in results] == paths
+    assert reader.peak_active == 4
+
+
+def test_prefetch_applies_back_pressure(monkeypatch):
+    reader = RecordingReader(duration=0.01)
+    monkeypatch.setattr(pipeline, 'read_workbook', reader)
+    paths = [f'report-{i}.xlsx' for i in range(10)]
+    prefetch_depth = 2
+
+    async def slow_consumer():
+        async for _ in prefetch_workbooks(paths, prefetch_depth=prefetch_depth):
+            with reader.lock:
+                reader.consumed += 1
+            await asyncio.sleep(0.05)
+
+    asyncio.run(slow_consumer())
+
+    assert reader.started == paths
+    for started, consumed in reader.started_vs_consumed:
+        assert started <= consumed + prefetch_depth + 1
+
+
+def test_prefetch_surfaces_read_errors(report_dir):
+    paths = find_workbooks(str(report_dir)) + [str(report_dir / 'missing.xlsx')]
+
+    with pytest.raises(FileNotFoundError):
+        asyncio.run(collect(paths, prefetch_depth=2))
+
+
+def test_prefetch_rejects_non_positive_depth(report_dir):
+    with pytest.raises(ValueError, match='prefetch_depth'):
+        asyncio.run(collect(find_workbooks(str(report_dir)), prefetch_depth=0))
+
+
+def test_process_reports_appends_each_run_to_history(report_dir, tmp_path):
+    history_dir = str(tmp_path / 'history')
+    paths = find_workbooks(str(report_dir))
+    asyncio.run(process_reports(paths, str(tmp_path / 'out'), history_dir=history_dir, persona='A'))
+
+    trend = query_history(history_dir, persona='A', aggregation_type='Age', attribute_name='18-24')
+    assert trend['Report Date'].tolist() == [f'2024-0{i}-01' for i in range(1, 5)]
+    assert trend['Persona Attribute Proportion'].tolist() == [10, 20, 30, 40]
+
+
+def test_process_reports_takes_persona_from_workbook_names(tmp_path):
+    input_dir = tmp_path / 'reports'
+    input_dir.mkdir()
+    write_workbook(input_dir / '2024-06-01_persona_a.xlsx', 0.1)
+    write_workbook(input_dir / '2024-06-01_persona_b.xlsx', 0.2)
+    history_dir = str(tmp_path / 'history')
+
+    asyncio.run(process_reports(find_workbooks(str(input_dir)), str(tmp_path / 'out'), history_dir=history_dir))
+
+    trend = query_history(history_dir, aggregation_type='Age', attribute_name='18-24')
+    assert trend['Persona'].tolist() == ['persona_a', 'persona_b']
+    assert trend['Persona Attribute Proportion'].tolist() == [10, 20]
+
+
+def test_process_reports_rejects_shared_history_key(tmp_path):
+    input_dir = tmp_path / 'reports'
+    input_dir.mkdir()
+    write_workbook(input_dir / '2024-06-01_persona_a.xlsx', 0.1)
+    write_workbook(input_dir / '2024-06-01_persona_b.xlsx', 0.2)
+    history_dir = tmp_path / 'history'
+
+    # A single persona for both workbooks would give them the same key
+    with pytest.raises(ValueError, match='share the report date'):
+        asyncio.run(process_reports(
+            find_workbooks(str(input_dir)), str(tmp_path / 'out'), history_dir=str(history_dir), persona='A'
+        ))
+    assert not history_dir.exists()